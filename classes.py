@@ -1,12 +1,22 @@
-from collections import deque
 from dataclasses import dataclass, field
-from typing import Dict, Tuple, List
+from typing import ClassVar, Tuple, List
+
+import numpy as np
 
 NodeId = int
 Timestamp = float
 
+# Q-values are expected delivery times in ticks; float32 resolves them to well
+# under a tick for any run length we simulate (integers are exact up to 2**24).
+# float16 is not enough: its spacing is already a full tick past 2048 and far
+# coarser than Q_EPSILON everywhere, so distinct estimates would collapse into ties.
+Q_DTYPE = np.float32
+Q_EPSILON = Q_DTYPE(1e-6)  # tolerance for treating two Q-values as tied
+
+QUEUE_CAPACITY = 16  # initial per-node queue size; doubled whenever it fills up
 
-@dataclass
+
+@dataclass(slots=True)
 class Hop:
     from_id: NodeId
     to_id: NodeId
@@ -14,89 +24,185 @@ class Hop:
     received: Timestamp
 
 
-@dataclass
+@dataclass(slots=True)
 class QTable:
-    q_values: Dict[Tuple[NodeId, NodeId, NodeId], float] = field(default_factory=dict)
-
-    def get(self, from_id: NodeId, destination: NodeId, to_id: NodeId) -> float:
-        return self.q_values.get((from_id, destination, to_id), 0.0)
-
-    def set(self, from_id: NodeId, destination: NodeId, to_id: NodeId, value: float):
-        self.q_values[(from_id, destination, to_id)] = value
+    """
+    Q-values of a single node as a dense [destination, neighbor slot] matrix.
+    Slot k holds the estimate for sending through neighbor_ids[k]; slots past
+    the node's degree are padding and hold +inf so they never win a min().
+    q_values is a read-only view into the network-wide tensor built by
+    link_q_tables; td_step does all reads and updates.
+    """
+    neighbor_ids: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int32))
+    q_values: np.ndarray = field(default_factory=lambda: np.empty((0, 0), dtype=Q_DTYPE))
+
+    def row(self, destination: NodeId) -> np.ndarray:
+        """View of the Q-values for one destination, one entry per neighbor slot."""
+        return self.q_values[destination, :len(self.neighbor_ids)]
 
     def __str__(self):
-        if not self.q_values:
+        if not self.q_values.size:
             return "QTable: (empty)"
-        lines = [" QTable:", " from_id | destination | to_id | value", "-" * 36]
-        for (from_id, destination, to_id), value in sorted(self.q_values.items()):
-            lines.append(f" {from_id:7} | {destination:11} | {to_id:5} | {value:6.2f}")
+        lines = [" QTable:", " destination | to_id | value", "-" * 28]
+        for destination in range(len(self.q_values)):
+            for to_id, value in zip(self.neighbor_ids, self.row(destination)):
+                lines.append(f" {destination:11} | {to_id:5} | {value:6.2f}")
         return "\n".join(lines)
 
 
-@dataclass
+@dataclass(slots=True)
 class Packet:
+    """
+    A routing request. While in flight its state lives in the simulator's
+    PacketPool; reached_destination, first_sent and last_received are filled in
+    on delivery.
+    """
     origin: NodeId
     destination: NodeId
-    route: List[Hop] = field(default_factory=list)
+    route: List[Hop] = field(default_factory=list)  # only filled when the simulator records routes
     reached_destination: bool = False
-    time_in_queue: int = 0
+    first_sent: Timestamp = -1
+    last_received: Timestamp = -1
     id: int = field(init=False)
 
-    _id_counter: int = 0  # class variable for auto-increment
+    _id_counter: ClassVar[int] = 0  # class variable for auto-increment
 
     def __post_init__(self):
         type(self)._id_counter += 1
         self.id = type(self)._id_counter
 
     def __str__(self):
-        return (f"Packet(id={self.id}, origin={self.origin}, destination={self.destination}, "
-                f"reached_destination={self.reached_destination}, "
-                f"time_in_queue={self.time_in_queue}, "
-                f"route_length={len(self.route)})")
+        text = (f"Packet(id={self.id}, origin={self.origin}, destination={self.destination}, "
+                f"reached_destination={self.reached_destination}")
+        if self.reached_destination:
+            text += f", first_sent={self.first_sent}, last_received={self.last_received}"
+        if self.route:  # only filled when the simulator records routes
+            text += f", route_length={len(self.route)}"
+        return text + ")"
+
+
+class PacketPool:
+    """
+    Per-hop state of every injected packet as parallel arrays (structure of
+    arrays), indexed by the row returned from add(). The tick loop gathers whole
+    columns with fancy indexing; capacity doubles whenever it runs out. Delivery
+    state is recorded on the Packet itself.
+    """
+    __slots__ = ('destination', 'queue_entry_time', 'first_sent', 'size')
+
+    def __init__(self, capacity: int = 64):
+        self.destination = np.empty(capacity, dtype=np.int32)
+        self.queue_entry_time = np.empty(capacity, dtype=np.int64)  # time in queue = now - queue_entry_time
+        self.first_sent = np.empty(capacity, dtype=np.int64)  # -1 until the packet leaves its origin
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, destination: NodeId, current_time: int) -> int:
+        """Registers a new packet queued at its origin and returns its row."""
+        index = self.size
+        if index == len(self.destination):
+            for name in ('destination', 'queue_entry_time', 'first_sent'):
+                column = getattr(self, name)
+                setattr(self, name, np.concatenate((column, np.empty_like(column))))
+        self.destination[index] = destination
+        self.queue_entry_time[index] = current_time
+        self.first_sent[index] = -1
+        self.size += 1
+        return index
+
+
+class IntRingBuffer:
+    """
+    FIFO of ints backed by a NumPy ring buffer. head and tail only grow and
+    positions wrap modulo the buffer size; the buffer doubles when it fills up.
+    """
+    __slots__ = ('buf', 'head', 'tail')
+
+    def __init__(self, capacity: int = QUEUE_CAPACITY):
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}")
+        self.buf = np.empty(capacity, dtype=np.int32)
+        self.head = 0
+        self.tail = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def append(self, value: int):
+        capacity = len(self.buf)
+        if self.tail - self.head == capacity:
+            self.buf = np.concatenate((self.view(), np.empty(capacity, dtype=np.int32)))
+            self.tail -= self.head
+            self.head = 0
+            capacity *= 2
+        self.buf[self.tail % capacity] = value
+        self.tail += 1
+
+    def popleft(self) -> int:
+        if self.head == self.tail:
+            raise IndexError("pop from an empty IntRingBuffer")
+        value = int(self.buf[self.head % len(self.buf)])
+        self.head += 1
+        return value
+
+    def view(self) -> np.ndarray:
+        """Queued values in FIFO order; a view when they are contiguous, otherwise a copy."""
+        capacity = len(self.buf)
+        start = self.head % capacity
+        end = start + len(self)
+        if end <= capacity:
+            return self.buf[start:end]
+        return np.concatenate((self.buf[start:], self.buf[:end - capacity]))
 
 
 class Node:
+    __slots__ = ('id', 'neighbors', 'neighbor_ids', 'neighbor_obj', 'queue', 'q_table')
+
     def __init__(self, node_id: NodeId):
         self.id = node_id
         self.neighbors: List['Node'] = []
-        self.queue: deque[Packet] = deque()
+        # frozen by finalize(): neighbor ids and objects indexed by Q-table slot
+        self.neighbor_ids = np.empty(0, dtype=np.int32)
+        self.neighbor_obj: Tuple['Node', ...] = ()
+        self.queue = IntRingBuffer()  # PacketPool rows waiting at this node
         self.q_table = QTable()
-        self.pending_requests: List[Tuple[Packet, 'Node']] = []  # used for delayed sends
-
-    def receive(self, hop: Hop, packet: Packet):
-        """Receives a packet; delivers if it's the destination, otherwise queues it."""
-        if self.id == packet.destination:
-            packet.reached_destination = True
-            packet.route.append(hop)
-            from metrics import metrics
-            metrics.on_delivered(packet)
-            print(f"[receive] Packet {packet.id} delivered to destination {self.id}")
-        else:
-            self.queue.append(packet)
-
-    def plan_send(self, packet: Packet, next_node: 'Node'):
-        """Plans to send a packet later (executed at the end of the tick)."""
-        self.pending_requests.append((packet, next_node))
-
-    def execute_pending_requests(self, current_time: int):
-        """Executes all planned sends at the end of the tick."""
-        for packet, next_node in self.pending_requests:
-            hop = Hop(
-                from_id=self.id,
-                to_id=next_node.id,
-                sent=current_time,
-                received=current_time + 1
-            )
-            packet.time_in_queue = 0
-            packet.route.append(hop)
-            # print(
-            #     f'[execute_pending_requests] Time={current_time} - NodeId={self.id} - Sending packet {packet} to NodeId={next_node.id}')
-            next_node.receive(hop, packet)
-        # Clear all pending requests after they’ve been processed
-        self.pending_requests.clear()
+
+    def finalize(self):
+        """Freezes the neighbor list into slot-indexed arrays once the topology is built."""
+        self.neighbor_ids = np.array([n.id for n in self.neighbors], dtype=np.int32)
+        self.neighbor_obj = tuple(self.neighbors)
 
     def __repr__(self):
         return (f"Node(id={self.id}, "
                 f"neighbors={[n.id for n in self.neighbors]}, "
-                f"queue_size={len(self.queue)}, "
-                f"pending_requests={len(self.pending_requests)})")
+                f"queue_size={len(self.queue)})")
+
+
+def link_q_tables(nodes: List[Node]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Allocates the network-wide Q tensor Q[node, destination, neighbor slot], its
+    per-(node, destination) minimum and argmin caches and the matching neighbor
+    table (node ids per slot, -1 for padding), and gives every node a QTable
+    viewing its own slice. The argmin cache holds -1 while the minimum is tied
+    (within Q_EPSILON) and has to be broken at random. Call once the topology
+    is final.
+    """
+    num_nodes = len(nodes)
+    max_degree = max(len(n.neighbors) for n in nodes)
+    q_tensor = np.full((num_nodes, num_nodes, max_degree), np.inf, dtype=Q_DTYPE)
+    neighbor_table = np.full((num_nodes, max_degree), -1, dtype=np.int32)
+    for node in nodes:
+        node.finalize()
+        degree = len(node.neighbor_ids)
+        neighbor_table[node.id, :degree] = node.neighbor_ids
+        q_tensor[node.id, :, :degree] = 0.0
+    q_min = q_tensor.min(axis=2)
+    # every entry starts at 0.0, so the minimum is only unique for single-neighbor nodes
+    q_best = np.full((num_nodes, num_nodes), -1, dtype=np.int8)
+    for node in nodes:
+        if len(node.neighbor_ids) == 1:
+            q_best[node.id] = 0
+        node.q_table = QTable(neighbor_ids=node.neighbor_ids, q_values=q_tensor[node.id])
+    return q_tensor, q_min, q_best, neighbor_table
@@ -0,0 +1,138 @@
+from typing import Tuple
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # numba is optional: the kernels run as plain Python without it
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+# fastmath without 'contract'/'reassoc': no FMA fusion or reordering, so the
+# compiled kernel stays bit-identical to the NumPy fallback below. Nor 'ninf'/'nnan':
+# Q is padded with +inf, so the kernel must not assume values are finite.
+@njit(cache=True, fastmath={'nsz', 'arcp', 'afn'})
+def td_step(Q: np.ndarray, Q_min: np.ndarray, Q_best: np.ndarray, neighbor_table: np.ndarray,
+            node_ids: np.ndarray, destinations: np.ndarray, times_in_queue: np.ndarray,
+            uniforms: np.ndarray, cursor: int, s: np.floating, eta: np.floating,
+            epsilon: np.floating) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Routing decision + TD update for every node with a queued packet.
+
+    For node_ids[i] holding a packet for destinations[i], picks the neighbor slot
+    with the minimum Q-value (ties within epsilon are broken uniformly at random
+    with the next draw from uniforms[cursor:]) and moves that estimate towards q + s + t, where t is
+    the chosen neighbor's best estimate. Q_best caches the argmin slot, or -1 when
+    the minimum is tied, so only tied rows are scanned. All reads happen before
+    any write, so the result does not depend on the order of node_ids. Pass s, eta
+    and epsilon in Q's dtype to keep the arithmetic in that precision. uniforms
+    must hold at least len(node_ids) draws past cursor. Updates Q, Q_min and
+    Q_best in place and returns (best_slots, old_estimations, new_values, cursor).
+    """
+    n = node_ids.shape[0]
+    max_degree = neighbor_table.shape[1]
+    best_slots = np.empty(n, dtype=np.int64)
+    old_estimations = np.empty(n, dtype=Q.dtype)
+    new_values = np.empty(n, dtype=Q.dtype)
+    tied_slots = np.empty(max_degree, dtype=np.int64)
+
+    # Phase 1: decide and compute the new estimates from the pre-tick values
+    for i in range(n):
+        node = node_ids[i]
+        destination = destinations[i]
+        best_slot = Q_best[node, destination]
+        if best_slot < 0:
+            # one pass over the row collects the tied slots, then the draw indexes them
+            min_q = Q_min[node, destination]
+            ties = 0
+            for k in range(max_degree):
+                if neighbor_table[node, k] < 0:
+                    break
+                if Q[node, destination, k] - min_q < epsilon:
+                    tied_slots[ties] = k
+                    ties += 1
+            best_slot = tied_slots[int(uniforms[cursor] * ties)]
+            cursor += 1
+
+        next_id = neighbor_table[node, best_slot]
+        old = Q[node, destination, best_slot]
+        t = Q_min[next_id, destination]
+        best_slots[i] = best_slot
+        old_estimations[i] = old
+        new_values[i] = old + eta * ((times_in_queue[i] + s + t) - old)
+
+    # Phase 2: scatter the updates and keep the min/argmin caches in step
+    for i in range(n):
+        node = node_ids[i]
+        destination = destinations[i]
+        Q[node, destination, best_slots[i]] = new_values[i]
+        if Q_min[node, destination] - new_values[i] >= epsilon:
+            # clearly below everything else in the row: the new unique minimum
+            Q_min[node, destination] = new_values[i]
+            Q_best[node, destination] = best_slots[i]
+        else:
+            # rescan this row's valid slots for the minimum and whether it is tied
+            row_min = Q[node, destination, 0]
+            argmin = 0
+            for k in range(1, max_degree):
+                if neighbor_table[node, k] < 0:
+                    break
+                if Q[node, destination, k] < row_min:
+                    row_min = Q[node, destination, k]
+                    argmin = k
+            ties = 0
+            for k in range(max_degree):
+                if neighbor_table[node, k] < 0:
+                    break
+                if Q[node, destination, k] - row_min < epsilon:
+                    ties += 1
+            Q_min[node, destination] = row_min
+            Q_best[node, destination] = argmin if ties == 1 else -1
+
+    return best_slots, old_estimations, new_values, cursor
+
+
+def td_step_numpy(Q: np.ndarray, Q_min: np.ndarray, Q_best: np.ndarray, neighbor_table: np.ndarray,
+                  node_ids: np.ndarray, destinations: np.ndarray, times_in_queue: np.ndarray,
+                  uniforms: np.ndarray, cursor: int, s: np.floating, eta: np.floating,
+                  epsilon: np.floating) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Vectorized equivalent of td_step: one gather of the (n, max_degree) slab of
+    Q rows, argmin/tie-break over it and one scatter of the updates. Draws the
+    same tie-break numbers in the same order, so both give identical results.
+    """
+    rows = np.arange(len(node_ids))
+    q_rows = Q[node_ids, destinations]  # padding slots are +inf and never tie
+    best_slots = Q_best[node_ids, destinations].astype(np.int64)
+
+    tied = np.flatnonzero(best_slots < 0)
+    if len(tied):
+        ties = q_rows[tied] - Q_min[node_ids[tied], destinations[tied]][:, None] < epsilon
+        picks = (uniforms[cursor:cursor + len(tied)] * ties.sum(axis=1)).astype(np.int64)
+        cursor += len(tied)
+        # the picks-th tied slot: the first tied slot whose running tie count exceeds it
+        best_slots[tied] = np.argmax(ties & (np.cumsum(ties, axis=1) > picks[:, None]), axis=1)
+
+    old_estimations = q_rows[rows, best_slots]
+    t = Q_min[neighbor_table[node_ids, best_slots], destinations]
+    new_values = old_estimations + eta * ((times_in_queue + s + t) - old_estimations)
+
+    Q[node_ids, destinations, best_slots] = new_values
+    q_rows[rows, best_slots] = new_values
+    min_q = q_rows.min(axis=1)
+    unique = (q_rows - min_q[:, None] < epsilon).sum(axis=1) == 1
+    Q_min[node_ids, destinations] = min_q
+    Q_best[node_ids, destinations] = np.where(unique, q_rows.argmin(axis=1), -1)
+
+    return best_slots, old_estimations, new_values, cursor
+
+
+# Interpreted, td_step's per-element loops are far slower than one NumPy sweep
+if not NUMBA_AVAILABLE:
+    td_step = td_step_numpy
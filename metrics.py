@@ -13,8 +13,10 @@ class Metrics:
 
     def __init__(self, sample_every: int = 100):
         self.sample_every = sample_every
-        from simulation import Packet
         self.delivered_packets: List[Packet] = []
+        # running totals over delivered packets that were sent at least once
+        self._total_delivery_ticks = 0
+        self._delivered_count = 0
         self.series: Dict[str, List[Tuple[int, float]]] = {}
         self._current_label: str | None = None
 
@@ -27,30 +29,29 @@ class Metrics:
     def on_delivered(self, packet: Packet):
         """Register that a packet has been delivered."""
         self.delivered_packets.append(packet)
+        if packet.first_sent >= 0:
+            self._total_delivery_ticks += self.delivery_time(packet)
+            self._delivered_count += 1
 
-    def sample_if_needed(self, time: int):
-        """Sample avg delivery time based on sampling policy."""
+    def sample(self, time: int):
+        """Append (time, avg delivery time) to the current series; callers check the sampling policy."""
         if self._current_label is None:
             return
-        if time % self.sample_every == 0:
-            avg = self.average_delivery_time_so_far()
-            self.series[self._current_label].append((time, avg))
+        self.series[self._current_label].append((time, self.average_delivery_time_so_far()))
 
     # ---- computations ----
     @staticmethod
     def delivery_time(p: Packet) -> int:
         """Total travel time in ticks: first sent to last received."""
-        if not p.route:
+        if p.first_sent < 0:
             return 0
-        return int(p.route[-1].received - p.route[0].sent)
+        return int(p.last_received - p.first_sent)
 
     def average_delivery_time_so_far(self) -> float:
-        """Average over all delivered packets so far (global view)."""
-        delivered_with_route = [p for p in self.delivered_packets if p.route] # <- FIXME: o delivered_packets está vacío, o p.route está vacío
-        if not delivered_with_route:
+        """Average over all delivered packets so far (global view), kept incrementally."""
+        if not self._delivered_count:
             return 0.0
-        total = sum(self.delivery_time(p) for p in delivered_with_route)
-        return total / len(delivered_with_route)
+        return self._total_delivery_ticks / self._delivered_count
 
     # ---- convenience getters ----
     def last_point(self, label: str) -> Tuple[int, float] | None:
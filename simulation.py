@@ -1,17 +1,28 @@
-from typing import List
+import logging
+from collections import deque
+from typing import List, Set, Tuple
 
-from classes import Node, Packet
-import random
+from classes import Q_DTYPE, Q_EPSILON, Hop, Node, NodeId, Packet, PacketPool, link_q_tables
+from kernels import td_step
+from metrics import metrics
 
-random.seed(42)
-time = 0
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# TD update constants, in Q_DTYPE so the update stays in single precision end to end
+S = Q_DTYPE(1)  # transmission time of one hop
+ETA = Q_DTYPE(0.5)  # learning rate
+
+TIE_BREAK_BATCH = 4096  # uniforms drawn from the simulator's generator at a time
 
-def create_irregular_6x6_grid() -> List[Node]:
-    nodes = [Node(i) for i in range(36)]
+
+def _irregular_6x6_edges() -> Tuple[Tuple[NodeId, NodeId], ...]:
+    adjacency: List[Set[NodeId]] = [set() for _ in range(36)]
 
     def connect(a, b):
-        nodes[a].neighbors.append(nodes[b])
-        nodes[b].neighbors.append(nodes[a])
+        adjacency[a].add(b)
+        adjacency[b].add(a)
 
     # Build regular grid
     for i in range(36):
@@ -25,15 +36,35 @@ def create_irregular_6x6_grid() -> List[Node]:
     holes = {14, 15, 20, 21}
 
     def remove(a, b):
-        if nodes[b] in nodes[a].neighbors:
-            nodes[a].neighbors.remove(nodes[b])
-        if nodes[a] in nodes[b].neighbors:
-            nodes[b].neighbors.remove(nodes[a])
+        adjacency[a].discard(b)
+        adjacency[b].discard(a)
 
     # Remove vertical edges:
     remove(14, 20)
     remove(15, 21)
 
+    return tuple((a, b) for a in range(36) for b in sorted(adjacency[a]) if a < b)
+
+
+def _neighbor_lists(edges: Tuple[Tuple[NodeId, NodeId], ...], num_nodes: int) -> Tuple[Tuple[NodeId, ...], ...]:
+    adjacency: List[List[NodeId]] = [[] for _ in range(num_nodes)]
+    for a, b in edges:
+        adjacency[a].append(b)
+        adjacency[b].append(a)
+    return tuple(tuple(sorted(ids)) for ids in adjacency)
+
+
+# the topology is static: its edge list and per-node neighbor ids are worked out once, at import.
+# Neighbor ids are in ascending order, which fixes each neighbor's Q-table slot.
+IRREGULAR_6X6_EDGES = _irregular_6x6_edges()
+IRREGULAR_6X6_NEIGHBORS = _neighbor_lists(IRREGULAR_6X6_EDGES, 36)
+
+
+def create_irregular_6x6_grid() -> List[Node]:
+    """Builds fresh nodes (empty queues, no Q-tables yet) wired by IRREGULAR_6X6_NEIGHBORS."""
+    nodes = [Node(i) for i in range(36)]
+    for node, neighbor_ids in zip(nodes, IRREGULAR_6X6_NEIGHBORS):
+        node.neighbors = [nodes[j] for j in neighbor_ids]
     return nodes
 
 
@@ -49,120 +80,182 @@ def packets_are_delivered(packets: List[Packet]) -> bool:
     return all(p.reached_destination for p in packets)
 
 
-def tick(nodes: List[Node]):
-    """Simulates one tick of the system with a two-phase update (plan + execute)."""
-    global time
-    # Phase 1: Decision (plan all sends)
-    for node in nodes:
-        if not node.queue:
-            continue
-
-        packet = node.queue.popleft()
-        if packet.reached_destination:
-            print(f'\n[tick] Time={time} - NodeId={node.id} - Packet {packet} already delivered')
-            continue
-
-        # print(f'\n[tick] Time={time} - NodeId={node.id} - Processing packet {packet}')
-
-        # Choose next node based on minimum Q-value
-        # el paper no explica que pasa en caso de "empate", asi que elegimos aleatoriamente entre los mejores
-        q_values = [node.q_table.get(node.id, packet.destination, n.id) for n in node.neighbors]
-        min_q = min(q_values)
-        epsilon = 1e-6  # tolerance for equality
-
-        best_candidates = [n for n, q in zip(node.neighbors, q_values) if abs(q - min_q) < epsilon]
-
-        if len(best_candidates) > 1:
-            best_next_node = random.choice(best_candidates)
-        else:
-            best_next_node = best_candidates[0]
-
-        print(f'---\n[tick] Time={time} - NodeId={node.id} - {node.q_table}')
-        print(f'[tick] Time={time} - NodeId={node.id} - Chose next node {best_next_node.id} for packet {packet}')
-
-        # Update Q-value for the (node, destination, next_node) triplet using Temporal Difference Learning
-        old_estimation = node.q_table.get(node.id, packet.destination, best_next_node.id)
-
-        # compute t = next node's best estimate
-        min_next_neighbor = min(
-            best_next_node.neighbors,
-            key=lambda z: best_next_node.q_table.get(best_next_node.id, packet.destination, z.id)
-        )
-        t = best_next_node.q_table.get(best_next_node.id, packet.destination, min_next_neighbor.id)
-
-        q = packet.time_in_queue
-        s = 1
-        eta = 0.5
-
-        delta = eta * ((q + s + t) - old_estimation)
-
-        new_value = old_estimation + delta
-
-        print(
-            f'[tick] Time={time} - NodeId={node.id} - Updating Q-value [from={node.id}, destination={packet.destination}, to={best_next_node.id}] from {old_estimation:.2f} to {new_value:.2f}')
-
-        node.q_table.set(node.id, packet.destination, best_next_node.id, new_value)
-
-        # Increment queue time for other packets
-        for p in node.queue:
-            p.time_in_queue += 1
-            print(
-                f'[tick] Time={time} - NodeId={node.id} - Incrementing time_in_queue for packet {p} to {p.time_in_queue}')
-
-        # Schedule the packet to be sent (not yet executed)
-        node.plan_send(packet, best_next_node)
-
-    # Phase 2: Execution (perform all sends at once)
-    for node in nodes:
-        node.execute_pending_requests(time)
-
-    time += 1
-    from metrics import metrics
-    metrics.sample_if_needed(time)
-
-
-def run_gradual_load_scenario(nodes, total: int, gap: int, label: str):
+class Simulator:
     """
-    Inject `total` packets, one every `gap` ticks, and step the simulator
-    until all injected packets are delivered.
+    Owns the simulation clock, the network-wide Q arrays and the packet pool,
+    and steps the network. Node queues hold PacketPool rows; the Packet
+    objects are only touched on injection, on delivery and when tracing.
+    Per-hop Hop records are only kept on packet.route when record_routes is set.
+    Ties between equally good neighbors are broken with the simulator's own
+    generator, so runs with the same seed are reproducible.
     """
-    from metrics import metrics
-    metrics.start_series(label)
-
-    pending = [generate_routing_request(nodes) for _ in range(total)]
-    active: List[Packet] = []
-    gap_counter = 0
-
-    print(f"[main] Scenario '{label}' -> total={total}, gap={gap}")
-
-    while pending or any(not p.reached_destination for p in active):
-        # inject if it's time and we still have packets
-        if gap_counter == 0 and pending:
-            pkt = pending.pop(0)
-            nodes[pkt.origin].queue.append(pkt)
-            active.append(pkt)
-            gap_counter = gap
-            print(f"[main] Sent new packet {pkt}")
-        else:
-            gap_counter = max(0, gap_counter - 1)
-
-        tick(nodes)
 
-    print(f"[main] Scenario '{label}' last avg:", metrics.last_point(label))
+    def __init__(self, nodes: List[Node], record_routes: bool = False, seed: int = 42):
+        self.nodes = nodes
+        self.time = 0
+        self.record_routes = record_routes
+        self.rng = np.random.default_rng(seed)
+        # tie-break draws are taken from the generator in bulk and consumed by td_step
+        self.tie_breaks = self.rng.random(TIE_BREAK_BATCH)
+        self.tie_cursor = 0
+        # Q tensor [node, destination, neighbor slot], its cached minimum and argmin
+        # over the neighbor slots [node, destination], and the node id behind each slot
+        self.Q, self.Q_min, self.Q_best, self.neighbor_table = link_q_tables(nodes)
+        # one row per injected packet; packet_objs[i] is the Packet behind row i
+        self.packets = PacketPool()
+        self.packet_objs: List[Packet] = []
+        self.in_flight = 0  # injected but not yet delivered
+        self.active_ids: Set[NodeId] = set()  # nodes whose queue is non-empty
+        self.next_sample = metrics.sample_every  # clock value of the next metrics sample
+
+    def inject(self, packet: Packet):
+        """Adds a packet to the packet pool and queues it at its origin."""
+        index = self.packets.add(packet.destination, self.time)
+        self.packet_objs.append(packet)
+        self.in_flight += 1
+        self.nodes[packet.origin].queue.append(index)
+        self.active_ids.add(packet.origin)
+
+    def tick(self):
+        """
+        Simulates one tick of the system with two-phase semantics (plan + execute)
+        in a single pass: every sending node's head packet is popped before any
+        packet moves, so a packet forwarded this tick lands behind that snapshot
+        and is not processed again until the next tick.
+        """
+        time = self.time
+        received = time + 1
+        debug = log.isEnabledFor(logging.DEBUG)  # checked once; tracing args are only built when set
+        # Every node with a queued packet decides at once in td_step: argmin over its
+        # Q row for the packet's destination, then the TD update. All reads happen
+        # before any write, so decisions within a tick are independent of node order.
+        active_ids = self.active_ids
+        if active_ids:
+            nodes = self.nodes
+            packets = self.packets
+            packet_objs = self.packet_objs
+            neighbor_table = self.neighbor_table
+            # sorted, so decisions and enqueue order match a scan over all nodes
+            node_ids = np.array(sorted(active_ids))
+            active_nodes = [nodes[node_id] for node_id in node_ids.tolist()]
+            indices = np.array([node.queue.popleft() for node in active_nodes])
+            for node in active_nodes:
+                if not node.queue:
+                    active_ids.discard(node.id)
+            destinations = packets.destination[indices]
+            q = (time - packets.queue_entry_time[indices]).astype(Q_DTYPE)
+
+            # Choose next node based on minimum Q-value, and update the Q-value for the
+            # (node, destination, next_node) triplet using Temporal Difference Learning
+            # el paper no explica que pasa en caso de "empate", asi que elegimos aleatoriamente entre los mejores
+            if debug:
+                # QTable.__str__ formats the whole table; only build it when it will be emitted
+                for node in active_nodes:
+                    log.debug("---\n[tick] Time=%d - NodeId=%d - %s", time, node.id, node.q_table)
+            if len(self.tie_breaks) - self.tie_cursor < len(node_ids):
+                # at most one draw per decision; top up with the unused tail kept first
+                self.tie_breaks = np.concatenate((self.tie_breaks[self.tie_cursor:], self.rng.random(TIE_BREAK_BATCH)))
+                self.tie_cursor = 0
+            best_slots, old_estimations, new_values, self.tie_cursor = td_step(
+                self.Q, self.Q_min, self.Q_best, neighbor_table, node_ids, destinations, q,
+                self.tie_breaks, self.tie_cursor, S, ETA, Q_EPSILON)
+
+            if debug:
+                for node_id, index, next_id, old_estimation, new_value in zip(
+                        node_ids, indices, neighbor_table[node_ids, best_slots], old_estimations, new_values):
+                    packet = packet_objs[index]
+                    log.debug("[tick] Time=%d - NodeId=%d - Chose next node %d for packet %s",
+                              time, node_id, next_id, packet)
+                    log.debug("[tick] Time=%d - NodeId=%d - Updating Q-value [from=%d, destination=%d, to=%d] from %.2f to %.2f",
+                              time, node_id, node_id, packet.destination, next_id, old_estimation, new_value)
+
+            # Send everything right away; packets arrive at the end of the tick
+            next_ids = neighbor_table[node_ids, best_slots]
+            first_sent = packets.first_sent
+            first_sent[indices[first_sent[indices] < 0]] = time
+            packets.queue_entry_time[indices] = received
+            delivered = next_ids == destinations
+            self.in_flight -= int(delivered.sum())
+
+            record_routes = self.record_routes
+            for node, index, best_slot, is_delivered in zip(
+                    active_nodes, indices.tolist(), best_slots.tolist(), delivered.tolist()):
+                best_next_node = node.neighbor_obj[best_slot]
+                if record_routes:
+                    packet_objs[index].route.append(Hop(
+                        from_id=node.id,
+                        to_id=best_next_node.id,
+                        sent=time,
+                        received=received
+                    ))
+                if is_delivered:
+                    packet = packet_objs[index]
+                    packet.reached_destination = True
+                    packet.first_sent = int(first_sent[index])
+                    packet.last_received = received
+                    metrics.on_delivered(packet)
+                    if debug:
+                        log.debug("[tick] Packet %d delivered to destination %d", packet.id, best_next_node.id)
+                else:
+                    best_next_node.queue.append(index)
+                    active_ids.add(best_next_node.id)
+
+        self.time += 1
+
+    def step(self):
+        """
+        tick() plus a metrics sample whenever the clock reaches the next multiple
+        of metrics.sample_every. Scenario loops call this; tick() never samples.
+        """
+        self.tick()
+        if self.time >= self.next_sample:
+            sample_every = metrics.sample_every
+            metrics.sample(self.time)
+            self.next_sample = self.time - self.time % sample_every + sample_every
+
+    def run_gradual_load_scenario(self, total: int, gap: int, label: str):
+        """
+        Inject `total` packets, one every `gap` ticks, and step the simulator
+        until all injected packets are delivered.
+        """
+        metrics.start_series(label)
+
+        nodes = self.nodes
+        pending = deque(generate_routing_request(nodes) for _ in range(total))
+        gap_counter = 0
+
+        log.info("[main] Scenario '%s' -> total=%d, gap=%d", label, total, gap)
+
+        while pending or self.in_flight:
+            # inject if it's time and we still have packets
+            if gap_counter == 0 and pending:
+                pkt = pending.popleft()
+                self.inject(pkt)
+                gap_counter = gap
+                log.debug("[main] Sent new packet %s", pkt)
+            else:
+                gap_counter = max(0, gap_counter - 1)
+
+            self.step()
+
+        log.info("[main] Scenario '%s' last avg: %s", label, metrics.last_point(label))
 
 
 def main():
+    # scenario summaries only; per-tick tracing is at DEBUG and never formatted unless enabled
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     nodes = create_irregular_6x6_grid()
+    sim = Simulator(nodes)
 
     # # ---- Low load: single packet ----
     # packet = generate_routing_request(nodes)
     # packets = [packet]
-    # nodes[packet.origin].queue.append(packet)
+    # sim.inject(packet)
     #
     # metrics.start_series("low_load_single")
     # print("[main] Starting simulation with 1 packet")
     # while not packets_are_delivered(packets):
-    #     tick(nodes)
+    #     sim.step()
     #
     # print("[main] Low-load last avg:", metrics.last_point("low_load_single"))
 
@@ -173,17 +266,17 @@ def main():
     # packet_1 = generate_routing_request(nodes)
     # packet_2 = generate_routing_request(nodes)
     # packets = [packet_1, packet_2]
-    # nodes[packet_1.origin].queue.append(packet_1)
+    # sim.inject(packet_1)
     #
     # metrics.start_series("low_load_double")
     # print("[main] Starting simulation with 2 packets")
     #
-    # time_until_injection = time + 5
+    # time_until_injection = sim.time + 5
     # while not packets_are_delivered(packets):
-    #     if time == time_until_injection:
-    #         nodes[packet_2.origin].queue.append(packet_2)
-    #         print(f"[main] Injected second packet {packet_2} at time {time}")
-    #     tick(nodes)
+    #     if sim.time == time_until_injection:
+    #         sim.inject(packet_2)
+    #         print(f"[main] Injected second packet {packet_2} at time {sim.time}")
+    #     sim.step()
     #
     # print("[main] Low-load double last avg:", metrics.last_point("low_load_double"))
 
@@ -195,29 +288,29 @@ def main():
     # packet_3 = generate_routing_request(nodes)
     # packets = [packet_1, packet_2, packet_3]
     #
-    # nodes[packet_1.origin].queue.append(packet_1)
+    # sim.inject(packet_1)
     #
     # metrics.start_series("low_load_triple")
     # print("[main] Starting simulation with 3 packets")
-    # time_until_injection_2 = time + 5
-    # time_until_injection_3 = time + 10
+    # time_until_injection_2 = sim.time + 5
+    # time_until_injection_3 = sim.time + 10
     # while not packets_are_delivered(packets):
-    #     if time == time_until_injection_2:
-    #         nodes[packet_2.origin].queue.append(packet_2)
-    #         print(f"[main] Injected second packet {packet_2} at time {time}")
-    #     if time == time_until_injection_3:
-    #         nodes[packet_3.origin].queue.append(packet_3)
-    #         print(f"[main] Injected third packet {packet_3} at time {time}")
-    #     tick(nodes)
+    #     if sim.time == time_until_injection_2:
+    #         sim.inject(packet_2)
+    #         print(f"[main] Injected second packet {packet_2} at time {sim.time}")
+    #     if sim.time == time_until_injection_3:
+    #         sim.inject(packet_3)
+    #         print(f"[main] Injected third packet {packet_3} at time {sim.time}")
+    #     sim.step()
     #
     # print("[main] Low-load triple last avg:", metrics.last_point("low_load_triple"))
     # metrics.plot()
 
-    # run_gradual_load_scenario(nodes, total=10, gap=10, label="gradual_10pk_gap10")
+    # sim.run_gradual_load_scenario(total=10, gap=10, label="gradual_10pk_gap10")
 
-    # run_gradual_load_scenario(nodes, total=30, gap=5, label="gradual_30pk_gap5")
+    # sim.run_gradual_load_scenario(total=30, gap=5, label="gradual_30pk_gap5")
 
-    # run_gradual_load_scenario(nodes, total=60, gap=2, label="gradual_60pk_gap2")
+    # sim.run_gradual_load_scenario(total=60, gap=2, label="gradual_60pk_gap2")
 
     # for label in ["gradual_10pk_gap10", "gradual_30pk_gap5", "gradual_60pk_gap2"]:
     #     print(f"[main] {label} last avg:", metrics.last_point(label))
@@ -226,11 +319,10 @@ def main():
 
     # print("[main] All scenarios completed!")
 
-    run_gradual_load_scenario(nodes, total=1000, gap=10, label="gradual_1000pk_gap10")
+    sim.run_gradual_load_scenario(total=1000, gap=10, label="gradual_1000pk_gap10")
 
-    from metrics import metrics
     metrics.plot()
-    print("[main] gradual_60pk_gap2 last avg:", metrics.last_point("gradual_1000pk_gap10"))
+    log.info("[main] gradual_60pk_gap2 last avg: %s", metrics.last_point("gradual_1000pk_gap10"))
 
 
 if __name__ == "__main__":
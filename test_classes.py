@@ -0,0 +1,42 @@
+import unittest
+
+from classes import IntRingBuffer
+
+
+class IntRingBufferTest(unittest.TestCase):
+
+    def test_fifo_order_across_grow_while_wrapped(self):
+        queue = IntRingBuffer(4)
+        for value in range(4):
+            queue.append(value)
+        self.assertEqual(queue.popleft(), 0)
+        self.assertEqual(queue.popleft(), 1)
+        for value in range(4, 10):  # wraps past the end, then grows with head > 0
+            queue.append(value)
+        self.assertEqual(len(queue.buf), 8)
+        self.assertEqual([queue.popleft() for _ in range(len(queue))], list(range(2, 10)))
+
+    def test_view_of_wrapped_contents(self):
+        queue = IntRingBuffer(4)
+        for value in range(4):
+            queue.append(value)
+        queue.popleft()
+        queue.popleft()
+        queue.append(4)
+        queue.append(5)
+        self.assertEqual(queue.view().tolist(), [2, 3, 4, 5])
+        self.assertEqual(len(queue.buf), 4)
+
+    def test_popleft_on_empty_raises(self):
+        queue = IntRingBuffer(4)
+        with self.assertRaises(IndexError):
+            queue.popleft()
+        queue.append(7)
+        self.assertEqual(queue.popleft(), 7)
+        with self.assertRaises(IndexError):
+            queue.popleft()
+        self.assertEqual(len(queue), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
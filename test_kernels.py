@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+
+from classes import Q_DTYPE, Q_EPSILON
+from kernels import NUMBA_AVAILABLE, td_step, td_step_numpy
+
+
+def random_network(rng: np.random.Generator, num_nodes: int = 12, max_degree: int = 4):
+    """Q arrays with padded rows and many exact and near (within Q_EPSILON) ties."""
+    degrees = rng.integers(1, max_degree + 1, size=num_nodes)
+    neighbor_table = np.full((num_nodes, max_degree), -1, dtype=np.int32)
+    Q = np.full((num_nodes, num_nodes, max_degree), np.inf, dtype=Q_DTYPE)
+    for node, degree in enumerate(degrees):
+        neighbor_table[node, :degree] = rng.choice(num_nodes, size=degree, replace=False)
+        values = rng.integers(0, 3, size=(num_nodes, degree)).astype(Q_DTYPE)
+        values += (rng.random((num_nodes, degree)) < 0.2) * Q_DTYPE(Q_EPSILON / 4)
+        Q[node, :, :degree] = values
+    Q_min = Q.min(axis=2)
+    ties = (Q - Q_min[:, :, None] < Q_EPSILON).sum(axis=2)
+    Q_best = np.where(ties == 1, Q.argmin(axis=2), -1).astype(np.int8)
+    return Q, Q_min, Q_best, neighbor_table
+
+
+@unittest.skipUnless(NUMBA_AVAILABLE, "td_step is td_step_numpy without numba")
+class TdStepEquivalenceTest(unittest.TestCase):
+
+    def test_numba_and_numpy_kernels_agree(self):
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            Q, Q_min, Q_best, neighbor_table = random_network(rng)
+            num_nodes = len(Q)
+            self.assertTrue((Q_best < 0).any())
+            count = int(rng.integers(1, num_nodes + 1))
+            node_ids = np.sort(rng.choice(num_nodes, size=count, replace=False))
+            destinations = rng.integers(0, num_nodes, size=count).astype(np.int32)
+            times_in_queue = rng.integers(0, 5, size=count).astype(Q_DTYPE)
+            uniforms = rng.random(count + 3)
+            cursor = 3
+
+            arrays = [(Q.copy(), Q_min.copy(), Q_best.copy()) for _ in range(2)]
+            results = [
+                kernel(*state, neighbor_table, node_ids, destinations, times_in_queue,
+                       uniforms, cursor, Q_DTYPE(1), Q_DTYPE(0.5), Q_EPSILON)
+                for kernel, state in zip((td_step, td_step_numpy), arrays)]
+
+            for numba_array, numpy_array in zip(*arrays):
+                np.testing.assert_array_equal(numba_array, numpy_array)
+            for numba_out, numpy_out in zip(results[0][:3], results[1][:3]):
+                np.testing.assert_array_equal(numba_out, numpy_out)
+            self.assertEqual(results[0][3], results[1][3])
+
+
+if __name__ == "__main__":
+    unittest.main()